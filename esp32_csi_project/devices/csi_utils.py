@@ -0,0 +1,433 @@
+import os
+import platform
+from datetime import datetime
+import numpy as np
+from typing import List
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+try:
+    from numba import njit
+except ImportError:  # Falls back to np.fromstring / token-by-token parsing
+    njit = None
+
+try:
+    import liburing
+except ImportError:  # io_uring appends are an optional Linux fast path
+    liburing = None
+
+MAX_CSI_VALUES = 1024  # Size of the per-collector parse scratch buffer
+BINARY_DTYPE = np.dtype("<i2")  # Value format of binary firmware payloads
+PARQUET_BATCH_ROWS = 512  # Rows buffered before a row group is written
+PARQUET_COMPRESSION = "zstd"
+PARQUET_COMPRESSION_LEVEL = 3
+URING_ENTRIES = 8  # Submission queue depth for the io_uring appender
+CSV_DSYNC = False  # Open CSV files with O_DSYNC so each block write is durable
+_INT32_LIMIT = 1 << 31  # Parsed values must lie in [-_INT32_LIMIT, _INT32_LIMIT)
+
+
+class ParquetCSIWriter:
+    """Write CSI rows to a Parquet file as int32 subcarrier columns
+
+    A Parquet file has one schema, so when the subcarrier count changes
+    the current file is closed and writing continues in file_path with a
+    _partN suffix.
+    """
+
+    def __init__(self, file_path: str, batch_rows: int = PARQUET_BATCH_ROWS):
+        if pq is None:
+            raise ImportError("pyarrow is required for Parquet output (pip install pyarrow)")
+
+        self.file_path = file_path
+        self.batch_rows = batch_rows
+        self._base_path = file_path
+        self._part = 0
+        self._writer = None
+        self._n_sub = 0
+        self._timestamps: List = []
+        self._rows: List[np.ndarray] = []
+
+    def write_row(self, timestamp, csi_values: np.ndarray) -> None:
+        """Buffer one CSI row, writing a row group every batch_rows rows"""
+        if self._n_sub == 0:
+            self._n_sub = csi_values.size
+        elif csi_values.size != self._n_sub:
+            self._roll_over(csi_values.size)
+
+        self._timestamps.append(timestamp)
+        self._rows.append(csi_values)
+        if len(self._rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered rows as a single row group"""
+        if not self._rows:
+            return
+
+        mat = np.vstack(self._rows).astype(np.int32, copy=False)
+        columns = {"timestamp": pa.array(self._timestamps)}
+        for i in range(self._n_sub):
+            columns[f"subcarrier_{i}"] = pa.array(mat[:, i])
+        table = pa.table(columns)
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self.file_path,
+                table.schema,
+                compression=PARQUET_COMPRESSION,
+                compression_level=PARQUET_COMPRESSION_LEVEL,
+            )
+        self._writer.write_table(table)
+        self._timestamps.clear()
+        self._rows.clear()
+
+    def _roll_over(self, n_sub: int) -> None:
+        """Close the current file and continue in a new one for n_sub columns"""
+        self.close()
+        self._part += 1
+        root, ext = os.path.splitext(self._base_path)
+        self.file_path = f"{root}_part{self._part}{ext}"
+        self._n_sub = n_sub
+
+    def close(self) -> None:
+        """Write any remaining rows and close the file"""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _parse_csi_bytes(buf, out):
+    """Scan ASCII "v0,v1,..." bytes into out, returning the value count
+
+    Same token rule as _parse_csi_tokens: after trimming surrounding
+    whitespace a token must be -?[0-9]+ and fit in int32, otherwise it
+    is skipped.
+    """
+    n = 0
+    cur = 0
+    neg = False
+    has_digit = False
+    ended = False  # Whitespace seen after the token started
+    valid = True
+    for i in range(buf.size + 1):
+        c = int(buf[i]) if i < buf.size else 44  # Treat end of buffer as a final ','
+        if c == 44:  # ','
+            # Tokens with stray characters are skipped, like the old isdigit() guard
+            if has_digit and valid and n < out.size and cur <= (_INT32_LIMIT if neg else _INT32_LIMIT - 1):
+                out[n] = -cur if neg else cur
+                n += 1
+            cur = 0
+            neg = False
+            has_digit = False
+            ended = False
+            valid = True
+        elif 48 <= c <= 57 and not ended:  # '0'-'9'
+            # Saturate so out-of-range values are rejected instead of wrapping
+            cur = min(cur * 10 + (c - 48), _INT32_LIMIT + 1)
+            has_digit = True
+        elif c == 45 and not (neg or has_digit or ended):  # Leading '-'
+            neg = True
+        elif c == 32 or c == 9 or c == 10 or c == 13:  # Whitespace
+            ended = neg or has_digit
+        else:
+            valid = False
+    return n
+
+
+def _parse_csi_tokens(data, out):
+    """Pure-Python parse of "v0,v1,..." bytes into out, returning the value count"""
+    vals = []
+    for token in data.split(b","):
+        token = token.strip(b" \t\r\n")
+        # Skip malformed tokens instead of dropping the whole packet
+        digits = token[1:] if token[:1] == b"-" else token
+        if digits.isdigit():
+            value = int(token)
+            if -_INT32_LIMIT <= value < _INT32_LIMIT:
+                vals.append(value)
+    n = min(len(vals), out.size)
+    out[:n] = vals[:n]
+    return n
+
+
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+
+
+def _parse_csi_numpy(data, out):
+    """Parse "v0,v1,..." bytes with np.fromstring, returning the value count
+
+    np.fromstring is lenient (a lone '-' reads as 0), so it only runs on
+    payloads where every token is known to be valid: plain digits, '-'
+    followed by a digit, at most 9 digits (always within int32). Anything
+    else goes through the token filter.
+    """
+    shape = data.translate(_DIGITS_TO_ZERO)
+    if (not shape.translate(None, b"0-, \t\r\n")
+            and shape.count(b"-") == shape.count(b"-0")
+            and b"0000000000" not in shape):
+        try:
+            values = np.fromstring(data, dtype=np.int32, sep=",")
+        except ValueError:  # e.g. empty tokens or whitespace inside a number
+            values = None
+        if values is not None and values.size == shape.count(b",") + 1:
+            n = min(values.size, out.size)
+            out[:n] = values[:n]
+            return n
+    return _parse_csi_tokens(data, out)
+
+
+_parse_csi_native = njit(nogil=True)(_parse_csi_bytes) if njit is not None else None
+
+
+def parse_csi(data: bytes, out: np.ndarray) -> np.ndarray:
+    """Parse a comma-separated CSI payload into a new int32 array
+
+    Values are written into the scratch array out, by the Numba byte
+    scanner when numba is installed, otherwise by np.fromstring with a
+    token-by-token fallback for malformed payloads.
+    """
+    if _parse_csi_native is not None:
+        n = _parse_csi_native(np.frombuffer(data, dtype=np.uint8), out)
+    else:
+        n = _parse_csi_numpy(bytes(data), out)
+    return out[:n].copy()
+
+
+def format_csi_values(csi_values: np.ndarray, raw_csi: bytes = None) -> bytes:
+    """CSV text for csi_values, reusing raw_csi only if every token in it parsed"""
+    if raw_csi is not None and raw_csi.count(b",") + 1 == csi_values.size:
+        return raw_csi
+    return b",".join(b"%d" % v for v in csi_values.tolist())
+
+
+def format_csv_header(n_sub: int) -> bytes:
+    """CSV header line for rows of a timestamp and n_sub values"""
+    return b"timestamp,%s\n" % b",".join(b"subcarrier_%d" % i for i in range(n_sub))
+
+
+def describe_payload(raw_csi, csi_values: np.ndarray) -> str:
+    """Text of a payload for logging; binary payloads (raw_csi None) are formatted here"""
+    if raw_csi is None:
+        return format_csi_values(csi_values).decode()
+    return raw_csi.decode("ascii", errors="replace")
+
+
+def decode_binary_csi(data: bytes) -> np.ndarray:
+    """View a binary CSI payload as int16 values without copying
+
+    The firmware must pack every value as a little-endian int16 with no
+    separators: amplitudes, or I/Q interleaved as I0,Q0,I1,Q1,...
+    """
+    return np.frombuffer(data, dtype=BINARY_DTYPE)
+
+
+def format_timestamp(ts_ns: int, iso: bool = False) -> bytes:
+    """Format a time.time_ns() value for CSV: integer ns, or legacy ISO 8601"""
+    if iso:
+        return datetime.fromtimestamp(ts_ns / 1e9).isoformat().encode()
+    return b"%d" % ts_ns
+
+
+class CSIPacketProcessor:
+    """Turn (timestamp, payload) packets into CSI values, storage rows and log messages
+
+    Shared by the GUI and the headless collector: process() runs in the
+    packet worker thread and each front end only routes its results.
+    """
+
+    def __init__(self, parquet: ParquetCSIWriter = None, iso_timestamps: bool = False,
+                 binary: bool = False, min_values: int = 10, log_every: int = 50,
+                 verbose: bool = False, csv_header: bool = False):
+        self.parquet = parquet
+        self.csv_header = csv_header  # Prefix the first CSV row with its header line
+        self.iso_timestamps = iso_timestamps
+        self.binary = binary
+        self.min_values = min_values
+        self.log_every = log_every
+        self.verbose = verbose
+        self._scratch = np.empty(MAX_CSI_VALUES, dtype=np.int32)
+        self._log_ctr = 0
+
+    def process(self, packets) -> list:
+        """Process a batch of packets, returning (csi_values, csv_line, log_messages) for each"""
+        return [self._process_packet(timestamp, data) for timestamp, data in packets]
+
+    def _decode_packet(self, data):
+        """Return (raw_csi, csi_values); raw_csi is None for binary payloads
+
+        Binary rows are only turned into text when a CSV row is written.
+        """
+        if self.binary:
+            return None, decode_binary_csi(data)
+        # Payload is ASCII digits, '-' and ','; stay in bytes instead of decoding
+        raw_csi = bytes(data).strip()
+        return raw_csi, parse_csi(raw_csi, self._scratch)
+
+    def _process_packet(self, timestamp, data):
+        """Parse, validate, log and save one packet"""
+        messages = []
+        try:
+            # Validate and parse CSI values straight from the payload bytes
+            raw_csi, csi_values = self._decode_packet(data)
+        except Exception as e:
+            return None, None, [f"❌ Error processing data: {e}"]
+
+        if not csi_values.size:
+            messages.append("⚠️ Warning: No valid CSI values found in data")
+            return None, None, messages
+
+        if csi_values.size < self.min_values:
+            messages.append(f"⚠️ Warning: Only received {csi_values.size} values")
+
+        self._log_ctr += 1
+        if __debug__ and self.verbose:
+            messages.append(f"📥 Received Raw CSI: {describe_payload(raw_csi, csi_values)}")
+        if self._log_ctr % self.log_every == 0:
+            messages.append(f"✅ Received {self._log_ctr} packets, last had {csi_values.size} values")
+
+        # Parquet rows are written here; CSV rows go back for a block write
+        line = None
+        try:
+            if self.parquet is not None:
+                file_path = self.parquet.file_path
+                self.parquet.write_row(timestamp, csi_values)
+                if self.parquet.file_path != file_path:
+                    messages.append(f"⚠️ Subcarrier count changed to {csi_values.size}, "
+                                    f"continuing in {self.parquet.file_path}")
+            else:
+                ts = format_timestamp(timestamp, self.iso_timestamps)
+                line = b"%s,%s\n" % (ts, format_csi_values(csi_values, raw_csi))
+                if self.csv_header:
+                    # The column count is only known once the first packet arrives
+                    line = format_csv_header(csi_values.size) + line
+                    self.csv_header = False
+        except Exception as e:
+            messages.append(f"❌ Error saving data: {e}")
+        return csi_values, line, messages
+
+
+async def tune_ble_link(client, log=print):
+    """Ask the platform backend for a large MTU and a high-throughput link
+
+    Best effort and backend specific: failures are reported and ignored.
+    Returns (mtu, request): the negotiated ATT MTU (client.mtu_size) and
+    the WinRT connection parameter request, or None. The preference only
+    holds while the request is open, so keep it for the whole connection
+    and pass it to release_ble_link on disconnect. Messages go to log.
+    """
+    backend = getattr(client, "_backend", None)
+
+    # BlueZ exchanges the MTU itself; bleak only learns it once acquired
+    acquire_mtu = getattr(backend, "_acquire_mtu", None)
+    if acquire_mtu is not None:
+        try:
+            await acquire_mtu()
+        except Exception as e:
+            log(f"⚠️ Could not acquire MTU: {e}")
+
+    # WinRT (Windows 11+) accepts a preferred connection parameter set
+    request = None
+    requester = getattr(backend, "_requester", None)
+    if hasattr(requester, "request_preferred_connection_parameters"):
+        try:
+            try:
+                from winrt.windows.devices.bluetooth import BluetoothLEPreferredConnectionParameters
+            except ImportError:
+                from bleak_winrt.windows.devices.bluetooth import BluetoothLEPreferredConnectionParameters
+            request = requester.request_preferred_connection_parameters(
+                BluetoothLEPreferredConnectionParameters.throughput_optimized
+            )
+            log(f"📶 Connection parameter request: {request.status}")
+        except Exception as e:
+            log(f"⚠️ Could not request connection parameters: {e}")
+
+    return client.mtu_size, request
+
+
+def release_ble_link(request, log=print) -> None:
+    """Close a connection parameter request returned by tune_ble_link"""
+    if request is None:
+        return
+    try:
+        request.close()
+    except Exception as e:
+        log(f"⚠️ Could not release connection parameters: {e}")
+
+
+class FdAppender:
+    """Append byte blocks with os.write on an O_APPEND descriptor
+
+    Skips Python's io layer (buffering, locking, newline translation);
+    each block is one kernel append.
+    """
+
+    def __init__(self, file_path: str, dsync: bool = CSV_DSYNC):
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if dsync:
+            flags |= getattr(os, "O_DSYNC", 0)
+        self._fd = os.open(file_path, flags, 0o644)
+        self.closed = False
+
+    def write(self, block: bytes) -> int:
+        """Append block, retrying the remainder after a short write"""
+        view = memoryview(block)
+        while view:
+            view = view[os.write(self._fd, view):]
+        return len(block)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        os.close(self._fd)
+        self.closed = True
+
+
+class UringAppender(FdAppender):
+    """Append byte blocks to a file with one io_uring submission per block"""
+
+    def __init__(self, file_path: str, dsync: bool = CSV_DSYNC):
+        super().__init__(file_path, dsync)
+        self._ring = liburing.Ring()
+        self._cqe = liburing.Cqe()
+        try:
+            liburing.io_uring_queue_init(URING_ENTRIES, self._ring)
+        except Exception:
+            super().close()
+            raise
+
+    def write(self, block: bytes) -> int:
+        """Append block, resubmitting the remainder after a short write"""
+        view = memoryview(block)
+        while view:
+            iov = liburing.Iovec([view])
+            sqe = liburing.io_uring_get_sqe(self._ring)
+            liburing.io_uring_prep_writev(sqe, self._fd, iov)
+            liburing.io_uring_submit_and_wait(self._ring, 1)
+            liburing.io_uring_wait_cqe(self._ring, self._cqe)
+            try:
+                view = view[liburing.trap_error(self._cqe[0].res):]
+            finally:
+                liburing.io_uring_cq_advance(self._ring, 1)
+        return len(block)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        liburing.io_uring_queue_exit(self._ring)
+        super().close()
+
+
+def open_csv_appender(file_path: str, log=print) -> FdAppender:
+    """Open file_path for block appends, using io_uring on Linux when available"""
+    if platform.system() == "Linux" and liburing is not None:
+        try:
+            return UringAppender(file_path)
+        except Exception as e:  # e.g. io_uring disabled by the kernel or sandbox
+            log(f"⚠️ io_uring unavailable, falling back to os.write appends: {e}")
+    return FdAppender(file_path)
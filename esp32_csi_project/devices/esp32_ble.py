@@ -1,9 +1,12 @@
+import argparse
 import asyncio
 from bleak import BleakScanner, BleakClient
 import matplotlib.pyplot as plt
-import numpy as np
 from datetime import datetime
 import os
+import time
+from csi_utils import (CSIPacketProcessor, ParquetCSIWriter, open_csv_appender, release_ble_link,
+                       tune_ble_link)
 
 # BLE UUIDs
 SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
@@ -11,71 +14,143 @@ CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
 
 # Configuration
 DATA_FILE = os.path.join(os.path.dirname(__file__), "csi_data_full.csv")
+DATA_FILE_PARQUET = os.path.join(os.path.dirname(__file__), f"csi_data_{datetime.now():%Y%m%d_%H%M%S}.parquet")
+USE_PARQUET = False  # Write zstd-compressed Parquet (requires pyarrow) instead of CSV
+ISO_TIMESTAMPS = False  # Write legacy ISO 8601 CSV timestamps instead of integer ns
+# Binary payloads: firmware sends packed little-endian int16 values (amplitude,
+# or I/Q interleaved) instead of ASCII "v0,v1,...". Must match the firmware build.
+BINARY_MODE = False
+LOG_EVERY = 50  # Log a receive summary every N packets
+VERBOSE = False  # Also log every raw payload (slow at high notify rates)
 MIN_CSI_VALUES = 10
 RECONNECT_DELAY = 5  # seconds
 SCAN_INTERVAL = 1    # seconds
+SCAN_TIMEOUT = SCAN_INTERVAL * 5  # seconds to wait for the device to advertise
+FLUSH_INTERVAL = 0.25  # seconds between CSV block writes
 DEVICE_NAME = "ESP32_CSI_01"
 
 class CSICollector:
-    def __init__(self):
+    def __init__(self, iso_timestamps=ISO_TIMESTAMPS):
+        self.iso_timestamps = iso_timestamps
         self.csi_data_list = []
-        self._ensure_data_file()
+        self._pending: list[bytes] = []
+        self._queue = asyncio.Queue()
+        self._csv_fp = None
+        self._parquet = None
+        is_new = False
+        if USE_PARQUET:
+            self._parquet = ParquetCSIWriter(DATA_FILE_PARQUET)
+        else:
+            is_new = self._ensure_data_file()
+        self._processor = CSIPacketProcessor(
+            self._parquet, iso_timestamps, binary=BINARY_MODE, min_values=MIN_CSI_VALUES,
+            log_every=LOG_EVERY, verbose=VERBOSE, csv_header=is_new)
 
     def _ensure_data_file(self):
-        """Ensure data file exists with proper headers"""
+        """Open the data file for appending, returning True if it is new
+
+        New files get their timestamp,subcarrier_* header with the first
+        row, once the number of values is known.
+        """
         try:
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
             
-            # Create or check file headers
-            file_exists = os.path.exists(DATA_FILE)
-            with open(DATA_FILE, "a" if file_exists else "w") as f:
-                if not file_exists:
-                    f.write("timestamp,raw_csi\n")
+            # Keep a single handle open for the whole session; rows are
+            # written in blocks by _flusher (through io_uring on Linux)
+            is_new = not os.path.exists(DATA_FILE) or os.path.getsize(DATA_FILE) == 0
+            self._csv_fp = open_csv_appender(DATA_FILE)
+            return is_new
         except Exception as e:
             print(f"Error initializing data file: {e}")
             raise
 
     async def notification_handler(self, sender, data):
-        """Handle incoming CSI data from ESP32"""
-        try:
-            raw_csi = data.decode().strip()
-            print(f"📥 Received Raw CSI: {raw_csi}")
-
-            # Parse and validate CSI values
-            csi_values = [int(x) for x in raw_csi.split(",") if x.lstrip("-").isdigit()]
-            
-            if not csi_values:
-                print("⚠️ Warning: No valid CSI values found in data")
-                return
-                
-            if len(csi_values) < MIN_CSI_VALUES:
-                print(f"⚠️ Warning: Only received {len(csi_values)} values")
+        """Queue incoming CSI data from ESP32 for the packet worker"""
+        self._queue.put_nowait((time.time_ns(), data))
 
-            # Store data
-            self.csi_data_list.append(csi_values)
+    async def _packet_worker(self):
+        """Parse and save queued packets in a thread, off the event loop"""
+        while True:
+            packets = [await self._queue.get()]
+            while not self._queue.empty():
+                packets.append(self._queue.get_nowait())
 
-            # Save to file with error handling
+            work = asyncio.ensure_future(asyncio.to_thread(self._processor.process, packets))
+            try:
+                results = await asyncio.shield(work)
+            except asyncio.CancelledError:
+                # Keep the rows of the batch already handed to the thread
+                self._apply_results(await work)
+                raise
+            self._apply_results(results)
+
+    def _apply_results(self, results):
+        """Print log messages and keep the values and CSV rows of processed packets"""
+        for csi_values, line, messages in results:
+            for msg in messages:
+                print(msg)
+            if csi_values is not None:
+                self.csi_data_list.append(csi_values)
+            if line:
+                self._pending.append(line)
+
+    def _write_pending(self):
+        """Write all queued CSV rows as a single block"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._csv_fp.write(b"".join(pending))
+
+    async def _flusher(self):
+        """Periodically write queued CSV rows to disk from a worker thread"""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            if not self._pending:
+                continue
+            pending, self._pending = self._pending, []
+            # A slow or O_DSYNC write must not stall BLE notifications
+            write = asyncio.ensure_future(asyncio.to_thread(self._csv_fp.write, b"".join(pending)))
             try:
-                with open(DATA_FILE, "a") as f:
-                    timestamp = datetime.now().isoformat()
-                    f.write(f"{timestamp},{','.join(map(str, csi_values))}\n")
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # Finish this block before close() writes the rest
+                await asyncio.gather(write, return_exceptions=True)
+                raise
             except Exception as e:
-                print(f"❌ Error saving data: {e}")
-                return
-
-            print(f"✅ CSI Parsed: {len(csi_values)} values")
-        except Exception as e:
-            print(f"❌ Error processing data: {e}")
+                print(f"❌ Error flushing data: {e}")
+
+    def close(self):
+        """Process queued packets, flush pending rows and close the data file"""
+        packets = []
+        while not self._queue.empty():
+            packets.append(self._queue.get_nowait())
+        self._apply_results(self._processor.process(packets))
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._csv_fp is not None and not self._csv_fp.closed:
+            self._write_pending()
+            self._csv_fp.close()
 
     async def scan_and_connect(self):
         """Scan for and connect to ESP32 device"""
         print(f"🔍 Scanning for {DEVICE_NAME}...")
-        
+        worker = asyncio.create_task(self._packet_worker())
+        flusher = asyncio.create_task(self._flusher())
+
+        try:
+            await self._connect_loop()
+        finally:
+            worker.cancel()
+            flusher.cancel()
+            await asyncio.gather(worker, flusher, return_exceptions=True)
+
+    async def _connect_loop(self):
+        """Keep (re)connecting to the ESP32 and collecting notifications"""
         while True:  # Infinite loop for reconnection attempts
             try:
-                devices = await BleakScanner.discover()
-                esp32 = next((d for d in devices if d.name == DEVICE_NAME), None)
+                # Returns as soon as the device advertises instead of a full scan
+                esp32 = await BleakScanner.find_device_by_name(DEVICE_NAME, timeout=SCAN_TIMEOUT)
 
                 if not esp32:
                     print(f"❌ {DEVICE_NAME} not found, retrying in {RECONNECT_DELAY} seconds...")
@@ -84,8 +159,12 @@ class CSICollector:
 
                 print(f"✅ Connecting to {esp32.address}...")
 
-                async with BleakClient(esp32.address) as client:
+                async with BleakClient(esp32) as client:
+                    request = None
                     try:
+                        mtu, request = await tune_ble_link(client)
+                        print(f"📶 Negotiated MTU: {mtu}")
+
                         await client.start_notify(CHARACTERISTIC_UUID, self.notification_handler)
                         print("📡 Started receiving CSI data... Press Ctrl+C to stop.")
 
@@ -97,6 +176,8 @@ class CSICollector:
 
                     except Exception as e:
                         print(f"❌ BLE connection error: {e}")
+                    finally:
+                        release_ble_link(request)
 
             except Exception as e:
                 print(f"❌ Unexpected error: {e}")
@@ -104,14 +185,22 @@ class CSICollector:
             print(f"🔄 Retrying in {RECONNECT_DELAY} seconds...")
             await asyncio.sleep(RECONNECT_DELAY)
 
-async def main():
+async def main(iso_timestamps=ISO_TIMESTAMPS):
     """Main entry point"""
-    collector = CSICollector()
-    await collector.scan_and_connect()
+    collector = CSICollector(iso_timestamps=iso_timestamps)
+    try:
+        await collector.scan_and_connect()
+    finally:
+        collector.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect CSI data from the ESP32 over BLE")
+    parser.add_argument("--iso-timestamps", action="store_true",
+                        help="write ISO 8601 timestamps instead of integer nanoseconds")
+    args = parser.parse_args()
+
     try:
-        asyncio.run(main())
+        asyncio.run(main(iso_timestamps=args.iso_timestamps))
     except KeyboardInterrupt:
         print("\n⚡ Stopped by user")
     except Exception as e:
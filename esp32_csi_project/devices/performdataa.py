@@ -1,15 +1,105 @@
 import os
+import warnings
 import pandas as pd
 import numpy as np
+from datetime import datetime, timedelta, timezone
 import matplotlib.pyplot as plt
 from typing import List, Tuple, Optional
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # Multi-threaded CSV parsing is optional
+    pa = None
+    pacsv = None
+
+CSV_BLOCK_SIZE = 1 << 20  # Bytes per pyarrow CSV parse block
+CSV_TEXT_COLUMNS = ('timestamp', 'raw_csi')  # Always read as strings, whatever they contain
+
 def load_csi_data(file_path: str) -> pd.DataFrame:
-    """Load CSI data from CSV file"""
+    """Load CSI data from CSV, Parquet or Feather file (chosen by extension)"""
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"CSI data file not found: {file_path}")
     
-    return pd.read_csv(file_path)
+    if file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path, engine='pyarrow')
+    elif file_path.endswith('.feather'):
+        df = pd.read_feather(file_path)
+    else:
+        df = _read_csv(file_path)
+
+    if 'timestamp' in df.columns:
+        df['timestamp'] = _parse_timestamps(df['timestamp'])
+    return df
+
+def _parse_timestamps(col: pd.Series) -> pd.Series:
+    """Parse a timestamp column that may mix integer ns and ISO 8601 values
+
+    Collectors write integer nanoseconds since the epoch, older sessions
+    (and --iso-timestamps) write local-time ISO strings, and both can end
+    up appended to the same file. Every value is parsed on its own and
+    returned as naive local time, matching the ISO rows.
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    text = col.astype(str).str.strip()
+    is_ns = text.str.fullmatch(r'-?\d+')
+    parsed = pd.Series(pd.NaT, index=col.index, dtype='datetime64[ns]')
+    if is_ns.any():
+        parsed[is_ns] = pd.to_datetime(_ns_to_local(text[is_ns].astype('int64').to_numpy()), unit='ns')
+    if not is_ns.all():
+        parsed[~is_ns] = pd.to_datetime(text[~is_ns], errors='coerce', format='ISO8601')
+    return parsed
+
+def _read_csv(file_path: str) -> pd.DataFrame:
+    """Read a CSV with pyarrow's multi-threaded parser, falling back to pandas
+
+    The pyarrow path handles files whose rows are no wider than their
+    timestamp,subcarrier_* header; rows shorter than the header go to
+    pandas, which pads them with NaN. Files from older collectors (a
+    timestamp,raw_csi header over timestamp,v0,...,vN rows) and files
+    whose rows outgrew the header are read by _read_ragged_csv. Text
+    columns are pinned to strings so every path returns the same dtypes.
+    """
+    with open(file_path, 'rb') as f:
+        header = f.readline().rstrip(b'\r\n')
+    if header == b'timestamp,raw_csi':
+        return _read_ragged_csv(file_path)
+
+    if pacsv is not None:
+        try:
+            read_options = pacsv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE)
+            convert_options = pacsv.ConvertOptions(
+                column_types={col: pa.string() for col in CSV_TEXT_COLUMNS})
+            return pacsv.read_csv(file_path, read_options=read_options,
+                                  convert_options=convert_options).to_pandas()
+        except pa.ArrowInvalid:
+            # e.g. rows with fewer values than the header, which pandas pads with NaN
+            pass
+    try:
+        return pd.read_csv(file_path, dtype={col: str for col in CSV_TEXT_COLUMNS})
+    except pd.errors.ParserError:
+        # Rows wider than the header, e.g. after a subcarrier count change
+        return _read_ragged_csv(file_path)
+
+def _read_ragged_csv(file_path: str) -> pd.DataFrame:
+    """Read timestamp,v0,...,vN rows of any width, ignoring the header line"""
+    with open(file_path, 'rb') as f:
+        f.readline()
+        width = max((line.count(b',') + 1 for line in f), default=1)
+    names = ['timestamp'] + [f'subcarrier_{i}' for i in range(width - 1)]
+    return pd.read_csv(file_path, skiprows=1, header=None, names=names, dtype={'timestamp': str})
+
+def _ns_to_local(ns: np.ndarray) -> np.ndarray:
+    """Shift epoch nanoseconds to naive local time, like datetime.fromtimestamp
+
+    The UTC offset is looked up once per minute of data rather than once
+    per file, so rows on either side of a DST change get their own offset.
+    """
+    minutes, index = np.unique(ns // (60 * 10**9), return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(m) * 60, timezone.utc).astimezone().utcoffset()
+                        // timedelta(microseconds=1) * 1000 for m in minutes], dtype=np.int64)
+    return ns + offsets[index]
 
 def process_csi_data(df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
     """Process CSI data from DataFrame into numpy array"""
@@ -18,16 +108,17 @@ def process_csi_data(df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
     if not subcarriers:
         # If no subcarrier columns found, try parsing raw_csi column
         if 'raw_csi' in df.columns:
-            # Split raw_csi values and convert to float array
-            csi_data = np.array([row.split(',') for row in df['raw_csi'].astype(str)])
-            csi_data = csi_data.astype(float)
+            # Split raw_csi values in pandas' vectorized string path
+            csi_data = (df['raw_csi'].astype(str)
+                        .str.split(',', expand=True)
+                        .to_numpy(dtype=np.float32, na_value=np.nan))
             subcarriers = [f"subcarrier_{i}" for i in range(csi_data.shape[1])]
             return csi_data.T, subcarriers
         else:
             raise ValueError("No CSI data columns found in the file")
     
-    # Convert to numpy array
-    csi_amplitude = np.array([df[col] for col in subcarriers])
+    # Convert all subcarrier columns in one pass; keep rows contiguous per subcarrier
+    csi_amplitude = np.ascontiguousarray(df[subcarriers].to_numpy(dtype=np.float32, copy=False).T)
     return csi_amplitude, subcarriers
 
 def plot_csi_timeseries(csi_data: np.ndarray, 
@@ -59,10 +150,25 @@ def plot_csi_timeseries(csi_data: np.ndarray,
 
 def plot_csi_heatmap(csi_data: np.ndarray, 
                      title: str = "CSI Amplitude Heatmap",
-                     figsize: Tuple[int, int] = (10, 6)) -> None:
-    """Plot CSI data as a heatmap"""
+                     figsize: Tuple[int, int] = (10, 6),
+                     max_width: int = 2000) -> None:
+    """Plot CSI data as a heatmap, block-averaging time beyond max_width samples"""
+    num_samples = csi_data.shape[1]
+    if num_samples > max_width:
+        # Average consecutive samples so at most max_width columns are rasterized;
+        # the last block is NaN-padded so no trailing samples are dropped
+        block = -(-num_samples // max_width)
+        width = -(-num_samples // block)
+        padded = np.full((csi_data.shape[0], width * block), np.nan, dtype=np.float32)
+        padded[:, :num_samples] = csi_data
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN blocks stay NaN
+            csi_data = np.nanmean(padded.reshape(csi_data.shape[0], width, block), axis=2)
+
     plt.figure(figsize=figsize)
-    plt.imshow(csi_data, aspect='auto', cmap='viridis')
+    # Keep the x-axis in original sample units even when downsampled
+    extent = (-0.5, num_samples - 0.5, csi_data.shape[0] - 0.5, -0.5)
+    plt.imshow(csi_data, aspect='auto', cmap='viridis', extent=extent)
     plt.colorbar(label='Amplitude')
     plt.title(title)
     plt.xlabel('Time Sample')
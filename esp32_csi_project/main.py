@@ -1,5 +1,7 @@
 import sys
 import os
+import time
+import argparse
 import asyncio
 import numpy as np
 import matplotlib
@@ -12,6 +14,8 @@ from PySide6.QtCore import QTimer
 from qasync import QEventLoop, asyncSlot
 from bleak import BleakClient, BleakScanner
 from datetime import datetime
+from devices.csi_utils import (CSIPacketProcessor, ParquetCSIWriter, open_csv_appender,
+                               release_ble_link, tune_ble_link)
 
 # Configuration
 DEVICE_NAME = "ESP32_CSI_01"
@@ -19,14 +23,27 @@ SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
 DATA_DIR = os.path.join(os.path.dirname(__file__), "devices")
 MAX_SAMPLES = 100  # Maximum number of samples to show in waveform
+SCAN_TIMEOUT = 5  # Seconds to wait for the device to advertise
+PLOT_SUBCARRIERS = 3  # Number of subcarriers drawn in the waveform
+FLUSH_INTERVAL_MS = 250  # Interval between CSV block writes
+USE_PARQUET = False  # Write zstd-compressed Parquet (requires pyarrow) instead of CSV
+ISO_TIMESTAMPS = False  # Write legacy ISO 8601 CSV timestamps instead of integer ns
+# Binary payloads: firmware sends packed little-endian int16 values (amplitude,
+# or I/Q interleaved) instead of ASCII "v0,v1,...". Must match the firmware build.
+BINARY_MODE = False
+LOG_MAX_LINES = 500  # Lines kept in the log window
+LOG_EVERY = 50  # Log a receive summary every N packets
+VERBOSE = False  # Also log every raw payload (slow at high notify rates)
 
 class ESP32CSIWidget(QWidget):
-    def __init__(self):
+    def __init__(self, iso_timestamps=ISO_TIMESTAMPS):
         super().__init__()
         self.setWindowTitle("ESP32 CSI Collector")
+        self.iso_timestamps = iso_timestamps
         
         # Initialize data file path
         self.data_file = os.path.join(DATA_DIR, "csi_data_full.csv")
+        self.parquet_file = os.path.join(DATA_DIR, f"csi_data_{datetime.now():%Y%m%d_%H%M%S}.parquet")
         
         # Initialize plotting
         self.figure = Figure(figsize=(10, 4))
@@ -36,14 +53,31 @@ class ESP32CSIWidget(QWidget):
         self.ax.set_xlabel('Sample')
         self.ax.set_ylabel('Amplitude')
         self.ax.grid(True)
+
+        # Create persistent lines once; update_plot only swaps their data
+        self._lines = [self.ax.plot([], [], label=f'Subcarrier {i}')[0]
+                       for i in range(PLOT_SUBCARRIERS)]
+        self.ax.set_xlim(0, MAX_SAMPLES - 1)
+        self.ax.legend(loc='upper right')
+        self.figure.tight_layout()
         
         # Setup update timer
         self.plot_timer = QTimer()
         self.plot_timer.timeout.connect(self.update_plot)
         self.plot_timer.setInterval(100)  # Update every 100ms
+
+        # Setup CSV flush timer
+        self.flush_timer = QTimer()
+        self.flush_timer.timeout.connect(self.flush_data)
+        self.flush_timer.setInterval(FLUSH_INTERVAL_MS)
         
-        # Initialize data storage
-        self.latest_csi_data = []
+        # Initialize data storage (ring buffer allocated on first packet)
+        self._reset_ring()
+        self._queue = asyncio.Queue()
+        self._worker_task = None
+        self._flush_task = None
+        self._shutdown_task = None
+        self._shut_down = False
         
         # Create UI
         self._init_ui()
@@ -59,6 +93,7 @@ class ESP32CSIWidget(QWidget):
         self.stop_btn = QPushButton("Stop")
         self.log_edit = QPlainTextEdit()
         self.log_edit.setReadOnly(True)
+        self.log_edit.setMaximumBlockCount(LOG_MAX_LINES)  # Drop oldest lines instead of growing
         self.log_edit.setMaximumHeight(100)  # Limit log height
 
         # Create button layout
@@ -78,6 +113,7 @@ class ESP32CSIWidget(QWidget):
 
         # Initialize state
         self.client = None
+        self._link_request = None  # Held open for the connection's lifetime
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(False)
 
@@ -89,50 +125,133 @@ class ESP32CSIWidget(QWidget):
                 os.makedirs(DATA_DIR, exist_ok=True)
                 self.log(f"✅ Created directory: {DATA_DIR}")
             
-            # Create or verify CSV file
-            file_exists = os.path.exists(self.data_file)
-            with open(self.data_file, 'a') as f:
-                if not file_exists or f.tell() == 0:
-                    f.write("timestamp,raw_csi\n")
-                    self.log("✅ Initialized data file with headers")
-            
-            self.log(f"✅ Data file ready: {self.data_file}")
+            self._pending = []
+            self._csv_fp = None
+            self._parquet = None
+            is_new = False
+            if USE_PARQUET:
+                self._parquet = ParquetCSIWriter(self.parquet_file)
+            else:
+                # Keep a single handle open for the whole session; rows are
+                # written in blocks by flush_data (through io_uring on Linux)
+                is_new = not os.path.exists(self.data_file) or os.path.getsize(self.data_file) == 0
+                self._csv_fp = open_csv_appender(self.data_file, self.log)
+                if is_new:
+                    # Header is written with the first row, once the value count is known
+                    self.log("✅ Created new data file")
+
+            self._processor = CSIPacketProcessor(
+                self._parquet, self.iso_timestamps, binary=BINARY_MODE, log_every=LOG_EVERY,
+                verbose=VERBOSE, csv_header=is_new)
+            self.log(f"✅ Data file ready: {self.parquet_file if USE_PARQUET else self.data_file}")
             
         except Exception as e:
             self.log(f"❌ Error initializing data file: {e}")
             raise
 
+    def _reset_ring(self):
+        """Drop buffered samples; the ring is reallocated on the next packet"""
+        self._ring = None
+        self._widx = 0
+        self._count = 0
+
     def log(self, msg):
         """Add message to log window"""
         self.log_edit.appendPlainText(msg)
 
+    def flush_data(self):
+        """Start a block write of queued CSV rows unless one is still running"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._write_pending())
+
+    async def _write_pending(self):
+        """Write all queued CSV rows as a single block from a worker thread"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            # A slow or O_DSYNC write must not stall BLE notifications
+            await asyncio.to_thread(self._csv_fp.write, b"".join(pending))
+        except Exception as e:
+            self.log(f"❌ Error flushing data: {e}")
+
+    async def _flush_pending(self):
+        """Wait for a running block write, then write the rows still queued"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
+
+    def closeEvent(self, event):
+        """Finish collection and close the data files before the window closes"""
+        if self._shut_down:
+            super().closeEvent(event)
+            return
+
+        # Shutdown has to await BLE and the packet worker; close again when done
+        event.ignore()
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.ensure_future(self._shutdown())
+
+    async def _shutdown(self):
+        """Stop notifications, finish queued packets, then close the data files"""
+        self.plot_timer.stop()
+        self.flush_timer.stop()
+        try:
+            await self._disconnect_client()
+
+            # Wait for the in-flight batch, then process what is still queued
+            if self._worker_task is not None:
+                self._worker_task.cancel()
+                await asyncio.gather(self._worker_task, return_exceptions=True)
+            packets = []
+            while not self._queue.empty():
+                packets.append(self._queue.get_nowait())
+            self._apply_results(self._processor.process(packets))
+
+            # No worker thread is running now, so the writers can be closed
+            if self._parquet is not None:
+                self._parquet.close()
+            if self._csv_fp is not None and not self._csv_fp.closed:
+                await self._flush_pending()
+                self._csv_fp.close()
+        except Exception as e:
+            self.log(f"❌ Error during shutdown: {e}")
+        finally:
+            self._shut_down = True
+            self.close()
+
     def update_plot(self):
         """Update the waveform plot"""
-        if not self.latest_csi_data:
+        if not self._count:
             return
 
         try:
-            # Clear the plot
-            self.ax.clear()
-            
-            # Convert data to numpy array
-            data = np.array(self.latest_csi_data)
+            # Unroll the ring buffer into chronological order
+            if self._count < MAX_SAMPLES:
+                data = self._ring[:self._count]
+            else:
+                data = np.concatenate((self._ring[self._widx:], self._ring[:self._widx]))
             
-            # Plot each subcarrier
-            num_subcarriers = data.shape[1]
-            for i in range(min(3, num_subcarriers)):  # Show up to 3 subcarriers
-                self.ax.plot(data[:, i], label=f'Subcarrier {i}')
-            
-            # Update labels and grid
-            self.ax.set_title('CSI Waveform (Real-time)')
-            self.ax.set_xlabel('Sample')
-            self.ax.set_ylabel('Amplitude')
-            self.ax.grid(True)
-            self.ax.legend()
-            
-            # Update display
-            self.figure.tight_layout()
-            self.canvas.draw()
+            # Update each subcarrier line in place
+            x = np.arange(data.shape[0])
+            shown = data[:, :PLOT_SUBCARRIERS]
+            for i, line in enumerate(self._lines):
+                if i < shown.shape[1]:
+                    line.set_data(x, shown[:, i])
+                else:
+                    line.set_data([], [])
+
+            # Rescale when the data leaves the y-range or fills less than half
+            # of it, so an outlier does not squash the waveform once it has
+            # scrolled out of the ring
+            lo, hi = float(shown.min()), float(shown.max())
+            y_lo, y_hi = self.ax.get_ylim()
+            margin = max(1.0, (hi - lo) * 0.1)
+            if lo < y_lo or hi > y_hi or hi - lo + 2 * margin < (y_hi - y_lo) / 2:
+                self.ax.set_ylim(lo - margin, hi + margin)
+
+            # Schedule a repaint without blocking the event loop
+            self.canvas.draw_idle()
             
         except Exception as e:
             self.log(f"⚠️ Plot update error: {e}")
@@ -143,8 +262,8 @@ class ESP32CSIWidget(QWidget):
         """Connect to ESP32 device via BLE"""
         try:
             self.log("Scanning for ESP32_CSI_01...")
-            devices = await BleakScanner.discover()
-            esp32 = next((d for d in devices if d.name == DEVICE_NAME), None)
+            # Returns as soon as the device advertises instead of a full scan
+            esp32 = await BleakScanner.find_device_by_name(DEVICE_NAME, timeout=SCAN_TIMEOUT)
 
             if esp32 is None:
                 self.log("❌ ESP32_CSI_01 not found.")
@@ -154,11 +273,16 @@ class ESP32CSIWidget(QWidget):
             if self.client:
                 await self.client.disconnect()
                 self.client = None
+                self._release_link()
 
             # Create new client and connect
-            self.client = BleakClient(esp32.address)
+            self.client = BleakClient(esp32)
             await self.client.connect()
 
+            # Raise MTU / connection parameters where the backend allows it
+            mtu, self._link_request = await tune_ble_link(self.client, self.log)
+            self.log(f"📶 Negotiated MTU: {mtu}")
+
             # Verify service and characteristic are available
             services = self.client.services
             service = services.get_service(SERVICE_UUID)
@@ -182,43 +306,51 @@ class ESP32CSIWidget(QWidget):
                 except:
                     pass
             self.client = None
+            self._release_link()
             self.connect_btn.setEnabled(True)
             self.start_btn.setEnabled(False)
             self.stop_btn.setEnabled(False)
 
     async def notification_handler(self, sender, data):
-        """Handle incoming CSI data from ESP32"""
-        try:
-            raw_csi = data.decode().strip()
-            self.log(f"📥 Raw CSI Data: {raw_csi}")
-
-            # Validate and parse CSI values
-            csi_values = [int(x) for x in raw_csi.split(",") if x.lstrip("-").isdigit()]
-            if not csi_values:
-                self.log("⚠️ Warning: No valid CSI values found in data")
-                return
+        """Queue incoming CSI data from ESP32 for the packet worker"""
+        self._queue.put_nowait((time.time_ns(), data))
 
-            if len(csi_values) < 10:
-                self.log(f"⚠️ Warning: Only received {len(csi_values)} values")
+    async def _packet_worker(self):
+        """Parse and save queued packets in a thread, off the event loop"""
+        while True:
+            packets = [await self._queue.get()]
+            while not self._queue.empty():
+                packets.append(self._queue.get_nowait())
 
-            # Update plot data buffer
-            self.latest_csi_data.append(csi_values)
-            if len(self.latest_csi_data) > MAX_SAMPLES:
-                self.latest_csi_data.pop(0)
-
-            # Save to CSV file
+            work = asyncio.ensure_future(asyncio.to_thread(self._processor.process, packets))
             try:
-                timestamp = datetime.now().isoformat()
-                with open(self.data_file, "a") as f:
-                    f.write(f"{timestamp},{','.join(map(str, csi_values))}\n")
-            except Exception as e:
-                self.log(f"❌ Error saving data: {e}")
-
-            # Log success without blocking
-            self.log(f"✅ CSI Values: {len(csi_values)}")
-
-        except Exception as e:
-            self.log(f"❌ Error processing data: {e}")
+                results = await asyncio.shield(work)
+            except asyncio.CancelledError:
+                # Keep the results of the batch already handed to the thread
+                self._apply_results(await work)
+                raise
+            self._apply_results(results)
+
+    def _apply_results(self, results):
+        """Apply processed packets to widget state (event loop only)"""
+        for csi_values, line, messages in results:
+            for msg in messages:
+                self.log(msg)
+            if csi_values is not None:
+                self._store_sample(csi_values)
+            if line:
+                self._pending.append(line)
+
+    def _store_sample(self, csi_values):
+        """Write one sample into the plot ring buffer"""
+        # Reallocate if the subcarrier count changes
+        if self._ring is None or self._ring.shape[1] != csi_values.size:
+            self._ring = np.empty((MAX_SAMPLES, csi_values.size), dtype=np.int32)
+            self._widx = 0
+            self._count = 0
+        self._ring[self._widx] = csi_values
+        self._widx = (self._widx + 1) % MAX_SAMPLES
+        self._count = min(self._count + 1, MAX_SAMPLES)
 
     @asyncSlot()
     async def start_notify(self):
@@ -244,14 +376,17 @@ class ESP32CSIWidget(QWidget):
                 raise Exception("Required characteristic not found")
 
             # Clear previous data and start notifications
-            self.latest_csi_data = []
+            self._reset_ring()
+            if self._worker_task is None:
+                self._worker_task = asyncio.create_task(self._packet_worker())
             await self.client.start_notify(CHARACTERISTIC_UUID, self.notification_handler)
             self.log("✅ Started CSI data collection")
             self.start_btn.setEnabled(False)
             self.stop_btn.setEnabled(True)
             
-            # Start real-time plotting
+            # Start real-time plotting and periodic CSV flushing
             self.plot_timer.start()
+            self.flush_timer.start()
 
         except Exception as e:
             self.log(f"❌ Failed to start data collection: {e}")
@@ -261,6 +396,7 @@ class ESP32CSIWidget(QWidget):
             except:
                 pass
             self.client = None
+            self._release_link()
             self.connect_btn.setEnabled(True)
             self.start_btn.setEnabled(False)
             self.stop_btn.setEnabled(False)
@@ -271,6 +407,24 @@ class ESP32CSIWidget(QWidget):
         if not self.client:
             return
 
+        try:
+            await self._disconnect_client()
+        except Exception as e:
+            self.log(f"❌ Error during shutdown: {e}")
+        finally:
+            # Always reset state and stop plotting
+            self.plot_timer.stop()
+            self.flush_timer.stop()
+            await self._flush_pending()
+            self.connect_btn.setEnabled(True)
+            self.start_btn.setEnabled(False)
+            self.stop_btn.setEnabled(False)
+
+    async def _disconnect_client(self):
+        """Stop notifications and disconnect the current client, if any"""
+        if not self.client:
+            return
+
         try:
             # First try to stop notifications if connected
             if self.client.is_connected:
@@ -287,24 +441,27 @@ class ESP32CSIWidget(QWidget):
                     self.log("✅ Disconnected from device")
             except Exception as e:
                 self.log(f"⚠️ Warning: Could not disconnect cleanly: {e}")
-
-        except Exception as e:
-            self.log(f"❌ Error during shutdown: {e}")
         finally:
-            # Always reset state and stop plotting
             self.client = None
-            self.plot_timer.stop()
-            self.connect_btn.setEnabled(True)
-            self.start_btn.setEnabled(False)
-            self.stop_btn.setEnabled(False)
+            self._release_link()
+
+    def _release_link(self):
+        """Drop the preferred connection parameter request of the last connection"""
+        release_ble_link(self._link_request, self.log)
+        self._link_request = None
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="ESP32 CSI Collector")
+    parser.add_argument("--iso-timestamps", action="store_true",
+                        help="write ISO 8601 timestamps instead of integer nanoseconds")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
     loop = QEventLoop(app)
     asyncio.set_event_loop(loop)
 
     # Create and show window
-    window = ESP32CSIWidget()
+    window = ESP32CSIWidget(iso_timestamps=args.iso_timestamps)
     window.resize(800, 600)
     
     # Center window on screen
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "devices"))
+
+import csi_utils
+from csi_utils import MAX_CSI_VALUES, _parse_csi_bytes, _parse_csi_numpy, _parse_csi_tokens
+
+PAYLOADS = [
+    b"1,2,3",
+    b" 10 , -20 ,30\r\n",
+    b"",
+    b",",
+    b"1,,2",
+    b"-",
+    b"--1,1-,-1",
+    b"1 2,3",
+    b"- 4,5",
+    b"1a,2,b3,4",
+    b"+5,6",
+    b"1.5,7",
+    b"2147483647,2147483648,-2147483648,-2147483649",
+    b"99999999999999999999,8",
+    b"\x00,\xff,9",
+    b"\t-0\t,00012",
+    b"-,1",
+    b"1,-",
+    b" - ,1",
+    b"1,2,",
+    b"0000000001,-0000000002,3",
+]
+
+
+def _parse(parser, data):
+    out = np.zeros(MAX_CSI_VALUES, dtype=np.int32)
+    n = parser(data, out)
+    return out[:n].tolist()
+
+
+@pytest.mark.parametrize("data", PAYLOADS)
+def test_byte_scanner_matches_token_parser(data):
+    expected = _parse(_parse_csi_tokens, data)
+    assert _parse(lambda d, out: _parse_csi_bytes(np.frombuffer(d, dtype=np.uint8), out), data) == expected
+
+
+@pytest.mark.parametrize("data", PAYLOADS)
+def test_numpy_parser_matches_token_parser(data):
+    assert _parse(_parse_csi_numpy, data) == _parse(_parse_csi_tokens, data)
+
+
+@pytest.mark.skipif(csi_utils._parse_csi_native is None, reason="numba not installed")
+@pytest.mark.parametrize("data", PAYLOADS)
+def test_native_scanner_matches_token_parser(data):
+    expected = _parse(_parse_csi_tokens, data)
+    assert _parse(lambda d, out: csi_utils._parse_csi_native(np.frombuffer(d, dtype=np.uint8), out), data) == expected
+
+
+def test_parse_stops_at_scratch_size():
+    out = np.zeros(2, dtype=np.int32)
+    assert _parse_csi_tokens(b"1,2,3", out) == 2
+    assert _parse_csi_numpy(b"1,2,3", out) == 2
+    assert _parse_csi_bytes(np.frombuffer(b"1,2,3", dtype=np.uint8), out) == 2
@@ -0,0 +1,50 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "devices"))
+
+from csi_utils import CSIPacketProcessor
+from performdataa import load_csi_data, process_csi_data
+
+TS_NS = 1760000000123456789
+
+
+def test_collector_csv_round_trip(tmp_path):
+    processor = CSIPacketProcessor(csv_header=True, min_values=1)
+    results = processor.process([(TS_NS, b"1,-2,3"), (TS_NS + 1, b"4,5,-6")])
+    path = tmp_path / "csi.csv"
+    path.write_bytes(b"".join(line for _, line, _ in results))
+
+    df = load_csi_data(str(path))
+    csi_data, subcarriers = process_csi_data(df)
+
+    assert subcarriers == ["subcarrier_0", "subcarrier_1", "subcarrier_2"]
+    np.testing.assert_array_equal(csi_data, [[1, 4], [-2, 5], [3, -6]])
+    expected = pd.Timestamp(datetime.fromtimestamp(TS_NS // 10**9)) + pd.Timedelta(TS_NS % 10**9, "ns")
+    assert df["timestamp"].iloc[0] == expected
+
+
+def test_legacy_raw_csi_header(tmp_path):
+    path = tmp_path / "csi.csv"
+    path.write_bytes(b"timestamp,raw_csi\n%d,1,2,3\n%d,4,5\n" % (TS_NS, TS_NS + 1))
+
+    df = load_csi_data(str(path))
+    csi_data, subcarriers = process_csi_data(df)
+
+    assert subcarriers == ["subcarrier_0", "subcarrier_1", "subcarrier_2"]
+    np.testing.assert_array_equal(csi_data, [[1, 4], [2, 5], [3, np.nan]])
+    assert df["timestamp"].dt.year.tolist() == [2025, 2025]
+
+
+def test_rows_wider_than_header(tmp_path):
+    path = tmp_path / "csi.csv"
+    path.write_bytes(b"timestamp,subcarrier_0,subcarrier_1\n%d,1,2\n%d,3,4,5\n" % (TS_NS, TS_NS + 1))
+
+    csi_data, subcarriers = process_csi_data(load_csi_data(str(path)))
+
+    assert subcarriers == ["subcarrier_0", "subcarrier_1", "subcarrier_2"]
+    np.testing.assert_array_equal(csi_data, [[1, 3], [2, 4], [np.nan, 5]])